@@ -1,110 +1,230 @@
+import importlib.metadata
+import os
 import re
+import tempfile
 from datetime import timedelta
-from collections import defaultdict
+from collections import Counter
 
+import numpy as np
 from bytewax.dataflow import Dataflow
 from bytewax.inputs import ManualInputConfig
 from bytewax.outputs import StdOutputConfig, ManualOutputConfig
-from bytewax.execution import run_main
+from bytewax.execution import spawn_cluster
 from bytewax.window import TumblingWindowConfig, SystemClockConfig
-from textblob import TextBlob
-import spacy
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
 from twitter import get_rules, delete_all_rules, get_stream, set_stream_rules
 
 
-en = spacy.load('en_core_web_sm')
-sw_spacy = en.Defaults.stop_words
+# spacy's stop words cached as plain text next to this file,
+# so that restarts don't need to import spacy at all
+STOP_WORDS_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stop_words.txt")
+
+def load_stop_words(path=STOP_WORDS_CACHE):
+    """
+    Loads spacy's English stop words from the cache, rebuilding it from spacy
+    when it is missing, unreadable or was written for another spacy version
+    :param path: path of the cached stop words, a header line naming the
+        spacy version and word count followed by one word per line
+    :return: frozenset of stop words
+    """
+    # read from the installed package metadata, importing spacy is the slow part
+    header = f"# spacy {importlib.metadata.version('spacy')}"
+    try:
+        with open(path, encoding="utf-8") as f:
+            first, *words = f.read().splitlines()
+        if first == f"{header}, {len(words)} words":
+            return frozenset(words)
+    except (OSError, ValueError):
+        # ValueError covers an empty file and bytes that aren't utf-8
+        pass
+
+    from spacy.lang.en.stop_words import STOP_WORDS
+    stop_words = frozenset(STOP_WORDS)
+    # write to a temp file and move it into place, so a run that dies
+    # half way never leaves a truncated cache behind
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".stop_words.")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(f"{header}, {len(stop_words)} words\n")
+            f.writelines(f"{word}\n" for word in sorted(stop_words))
+        os.replace(tmp, path)
+    except OSError:
+        # a read-only checkout just goes without the cache
+        if tmp is not None:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    return stop_words
+
+
+sw_spacy = load_stop_words()
+
+# VADER's lexicon laid out for vectorized lookups:
+# word -> index into the array of valences
+lexicon = SentimentIntensityAnalyzer().lexicon
+lexicon_ids = {word: i for i, word in enumerate(lexicon)}
+valences = np.fromiter(lexicon.values(), dtype=np.float32, count=len(lexicon))
+
+# everything a tweet is stripped of, in a single pass: @usernames, links
+# and runs of special characters (which covers emojis, including ZWJ
+# sequences). Matching runs rather than one character at a time means
+# fewer substitutions per tweet
+_CLEAN_RE = re.compile(r"@\w+"
+                       r"|\w+://\S+"
+                       r"|[^0-9A-Za-z \t@]+"
+                       r"|@")
+# clean tweets only hold ascii letters, digits and spaces, so they can be
+# split into words with str methods instead of running a regex over them
+_DIGITS_TO_SPACES = str.maketrans("0123456789", " " * 10)
+
+# One process per core. Workers inside a single process are threads sharing
+# the GIL, so it takes separate processes to score batches at the same time.
+processes = os.cpu_count() or 1
+# Bytewax places each key on a worker by hashing the key itself, so a few
+# keys per process even out how many batches each process gets
+batch_keys = 4 * processes
 
 def input_builder(worker_index, worker_count, resume_state):
-    return get_stream()
+    # the API only allows one connection to the stream,
+    # so the first worker reads it and cleans the tweets
+    if worker_index == 0:
+        return get_stream()
+    return iter([])
 
 
-def remove_emoji(tweet):
+def clean_tweet(tweet):
     """
-    This function takes in a tweet and strips off most of the emojis for the different platforms
+    Removes emojis, usernames, links, spaces and special characters from a tweet
     :param tweet:
-    :return: tweet stripped off emojis
+    :return: clean tweet
     """
-    emoji_pattern = re.compile("["
-                               u"\U0001F600-\U0001F64F"  # emoticons
-                               u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                               u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                               u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-                               u"\U00002702-\U000027B0"
-                               u"\U000024C2-\U0001F251"
-                               "]+", flags=re.UNICODE)
-    return emoji_pattern.sub(r'', tweet)
-
-
-def remove_username(tweet):
+    return ' '.join(_CLEAN_RE.sub(" ", tweet).split())
+
+
+def split_words(tweet):
     """
-    Remove all the @usernames in a tweet
-    :param tweet:
-    :return: tweet without @username
+    Lowercases a clean tweet and splits it into words, dropping the numbers
+    :param tweet: clean tweet
+    :return: list of words
     """
-    return re.sub('@[\w]+', '', tweet)
+    return tweet.lower().translate(_DIGITS_TO_SPACES).split()
 
 
-def clean_tweet(tweet):
+# Add a fold window to collect the cleaned tweets into batches
+# over 1 second periods, so the sentiment step is called once
+# per batch instead of once per tweet. Tweets are spread over several
+# keys, so the batches are scored in all the processes.
+cc = SystemClockConfig()
+bc = TumblingWindowConfig(length=timedelta(seconds=1))
+
+def key_tweet(tweet):
+    return str(hash(tweet) % batch_keys), tweet
+
+
+def batch_tweets():
+    return []
+
+
+def add_tweet(batch, tweet):
+    batch.append(tweet)
+    return batch
+
+
+def score_sentiment(tweets):
     """
-    Removes spaces and special characters to a tweet
-    :param tweet:
-    :return: clean tweet
+    Determines the sentiment of tweets whether positive, negative or neutral
+    by summing the lexicon valences of their words
+    :param tweets: list of tweets
+    :return: list of sentiments, one per tweet
     """
-    return ' '.join(re.sub("(@[A-Za-z0-9]+)|([^0-9A-Za-z \t])|(\w+:\/\/\S+)", " ", tweet).split())
+    rows = []
+    ids = []
+    for row, tweet in enumerate(tweets):
+        for word in split_words(tweet):
+            i = lexicon_ids.get(word)
+            if i is not None:
+                rows.append(row)
+                ids.append(i)
+    # gather the valence of every matched word and sum them per tweet
+    scores = np.bincount(
+        np.array(rows, dtype=np.intp),
+        weights=valences[np.array(ids, dtype=np.intp)],
+        minlength=len(tweets))
+    sentiments = []
+    for score in scores:
+        if score > 0:
+            sentiments.append('positive')
+        elif score == 0:
+            sentiments.append('neutral')
+        else:
+            sentiments.append('negative')
+    return sentiments
 
 
-def get_tweet_sentiment(tweet):
+def get_batch_sentiment(key__batch):
     """
-    Determines the sentiment of a tweet whether positive, negative or neutral
-    :param tweet:
-    :return: sentiment and the tweet
+    Determines the sentiment of every tweet in a batch
+    :param key__batch: batch key and the list of tweets
+    :return: list of (sentiment, tweet)
     """
-    # create TextBlob object
-    get_analysis = TextBlob(tweet)
-    # get sentiment
-    if get_analysis.sentiment.polarity > 0:
-        return 'positive', tweet
-    elif get_analysis.sentiment.polarity == 0:
-        return 'neutral', tweet
-    else:
-        return 'negative', tweet
+    key, batch = key__batch
+    return list(zip(score_sentiment(batch), batch))
+
 
 def tokenize(sentiment__text):
     key, text = sentiment__text
-    tokens = re.findall(r'[^\s!,.?":;0-9]+', text)
-    data = [(key, word.lower()) for word in tokens if word.lower() not in sw_spacy]
-    return data
+    tokens = split_words(text)
+    words = [word for word in tokens if word not in sw_spacy]
+    return key, words
 
 # Add a fold window to capture the count of words
 # grouped by positive, negative and neutral sentiment
 # over 1 minute period and then write them to a file
-cc = SystemClockConfig()
 wc = TumblingWindowConfig(length=timedelta(seconds=60))
 
+# A busy window can see tens of thousands of distinct words while only the
+# top ten get written out, so once a window holds more than max_words
+# distinct words the rarest ones are pruned until at most half are left
+max_words = 50000
+
 def count_words():
-    return defaultdict(lambda:0)
+    return Counter()
 
 
-def count(results, word):
-    results[word] += 1
+def count(results, words):
+    results.update(words)
+    if len(results) > max_words:
+        # drop the words seen at most `floor` times, raising it as needed
+        floor = 1
+        while len(results) > max_words // 2:
+            results = Counter({word: n for word, n in results.items() if n > floor})
+            floor += 1
     return results
 
 
 def sort_dict(key__data):
     key, data = key__data
-    return (key, sorted(data.items(), key=lambda k_v: k_v[1], reverse=True)[:10])
+    return (key, data.most_common(10))
 
 
 def output_builder2(worker_index, worker_count):
+    # keep one open file per sentiment for the life of the worker
+    # and overwrite it in place every window
+    files = {}
+
     def write_to_file(key__data):
         sentiment, data = key__data
-        with open(f"outfile_{sentiment}.txt", 'w') as f:
-            f.seek(0)
-            for key, value in data:
-                f.write(f"{key}, {value}\n")
-    
+        f = files.get(sentiment)
+        if f is None:
+            f = files[sentiment] = open(f"outfile_{sentiment}.txt", 'w')
+        f.seek(0)
+        f.truncate()
+        f.write("".join(f"{key}, {value}\n" for key, value in data))
+        f.flush()
+
     return write_to_file
 
 
@@ -123,12 +243,17 @@ if __name__ == "__main__":
 
     flow = Dataflow()
     flow.input("input", ManualInputConfig(input_builder))
-    flow.map(remove_emoji)
-    flow.map(remove_username)
     flow.map(clean_tweet)
-    flow.map(get_tweet_sentiment)
+    flow.map(key_tweet)
+    flow.fold_window(
+        "batch_tweets",
+        cc,
+        bc,
+        builder = batch_tweets,
+        folder = add_tweet)
+    flow.flat_map(get_batch_sentiment)
     flow.inspect(print)
-    flow.flat_map(tokenize)
+    flow.map(tokenize)
     flow.fold_window(
         "count_words", 
         cc, 
@@ -138,4 +263,4 @@ if __name__ == "__main__":
     flow.map(sort_dict)
     flow.capture(ManualOutputConfig(output_builder2))
 
-    run_main(flow)
+    spawn_cluster(flow, proc_count=processes, worker_count_per_proc=1)
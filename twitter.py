@@ -1,32 +1,30 @@
 import os
 import requests
-import json
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 # To set your enviornment variables in your terminal run the following line:
 # export 'BEARER_TOKEN'='<your_bearer_token>'
 bearer_token = os.getenv("TWITTER_BEARER_TOKEN")
 
-
-def bearer_oauth(r):
-    """
-    Method required by bearer token authentication.
-    """
-
-    r.headers["Authorization"] = f"Bearer {bearer_token}"
-    r.headers["User-Agent"] = "v2FilteredStreamPython"
-    return r
+# The stream is sent with chunked transfer encoding, so reads return as soon
+# as a chunk arrives. A larger buffer than requests' 512 byte default means a
+# tweet usually arrives in one read instead of being stitched back together.
+STREAM_CHUNK_SIZE = 8192
 
 
 def get_rules():
-    response = requests.get(
-        "https://api.twitter.com/2/tweets/search/stream/rules", auth=bearer_oauth
-    )
+    response = session.get("https://api.twitter.com/2/tweets/search/stream/rules")
     if response.status_code != 200:
         raise Exception(
             "Cannot get rules (HTTP {}): {}".format(response.status_code, response.text)
         )
-    print(json.dumps(response.json()))
-    return response.json()
+    rules = json_loads(response.content)
+    print(response.text)
+    return rules
 
 
 def delete_all_rules(rules):
@@ -35,10 +33,8 @@ def delete_all_rules(rules):
 
     ids = list(map(lambda rule: rule["id"], rules["data"]))
     payload = {"delete": {"ids": ids}}
-    response = requests.post(
-        "https://api.twitter.com/2/tweets/search/stream/rules",
-        auth=bearer_oauth,
-        json=payload
+    response = session.post(
+        "https://api.twitter.com/2/tweets/search/stream/rules", json=payload
     )
     if response.status_code != 200:
         raise Exception(
@@ -46,12 +42,12 @@ def delete_all_rules(rules):
                 response.status_code, response.text
             )
         )
-    print(json.dumps(response.json()))
+    print(response.text)
 
 
 def get_stream():
-    response = requests.get(
-        "https://api.twitter.com/2/tweets/search/stream", auth=add_bearer_oauth, stream=True,
+    response = session.get(
+        "https://api.twitter.com/2/tweets/search/stream", stream=True,
     )
     print(response.status_code)
     if response.status_code != 200:
@@ -61,9 +57,9 @@ def get_stream():
             )
         )
     tweetnbr=0
-    for response_line in response.iter_lines():
+    for response_line in response.iter_lines(chunk_size=STREAM_CHUNK_SIZE):
         if response_line:
-            json_response = json.loads(response_line)
+            json_response = json_loads(response_line)
             tweet = json_response["data"]["text"]
             tweetnbr+=1
             yield tweetnbr, str(tweet)
@@ -78,6 +74,12 @@ def add_bearer_oauth(req):
     req.headers["User-Agent"] = "v2FilteredStreamPython"
     return req
 
+
+# All the API calls go through one session, so they reuse the same
+# connection instead of doing a new TCP and TLS handshake each time
+session = requests.Session()
+session.auth = add_bearer_oauth
+
 def set_stream_rules(search_terms):
     """
     Set the rules of the stream that we want the API to return
@@ -86,15 +88,11 @@ def set_stream_rules(search_terms):
     """
     # only get original tweets in english
     default_rules = 'followers_count:150 -is:retweet -is:reply is:verified -is:nullcast lang:en'
-    search_rules = []
-    for search_term in search_terms:
-        search_rules.append({"value": f"{search_term} {default_rules}"})
+    search_rules = [{"value": f"{search_term} {default_rules}"} for search_term in search_terms]
     payload = {"add": search_rules}
-    response = requests.post(
-        "https://api.twitter.com/2/tweets/search/stream/rules",
-        auth=add_bearer_oauth,
-        json=payload,
+    response = session.post(
+        "https://api.twitter.com/2/tweets/search/stream/rules", json=payload,
     )
     if response.status_code != 201:
         raise Exception("Cannot add rules (HTTP {}): {}".format(response.status_code, response.text))
-    print(json.dumps(response.json()))
\ No newline at end of file
+    print(response.text)
\ No newline at end of file